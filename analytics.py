@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+from database import get_connection
+
+# Raw sessions older than this are deleted; their totals live on in daily_file_stats
+SESSION_RETENTION_DAYS = 90
+
+
+def record_session(cur, file_id, open_time, duration):
+    """Add one closed session to the daily rollup for its file"""
+    day = datetime.fromtimestamp(open_time).date().isoformat()
+    cur.execute("""
+        INSERT INTO daily_file_stats(file_id, day, opens, total_duration)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT(file_id, day) DO UPDATE SET
+            opens = opens + 1,
+            total_duration = total_duration + excluded.total_duration
+    """, (file_id, day, duration))
+
+
+def delete_file_stats(cur, path):
+    """Remove the rollups of a file that is about to be deleted"""
+    cur.execute("""
+        DELETE FROM daily_file_stats
+        WHERE file_id IN (SELECT id FROM files WHERE path = ?)
+    """, (path,))
+
+
+def compact_sessions(retention_days=SESSION_RETENTION_DAYS):
+    """Delete raw sessions older than the retention window. Returns the count."""
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM sessions WHERE close_time < ?", (cutoff,))
+        deleted = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
+
+
+def _window_start(days):
+    return (date.today() - timedelta(days=days - 1)).isoformat()
+
+
+def top_files(days=30, limit=10, metric="duration"):
+    """Most-used files over the last `days` days, answered from the rollups.
+
+    `metric` is "duration" (total seconds open) or "opens". Returns dicts
+    with file_id, path, opens and total_duration.
+    """
+    order = {"duration": "total_duration", "opens": "opens"}[metric]
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT s.file_id, f.path, SUM(s.opens) AS opens,
+                   SUM(s.total_duration) AS total_duration
+            FROM daily_file_stats s JOIN files f ON f.id = s.file_id
+            WHERE s.day >= ? AND s.day <= ?
+            GROUP BY s.file_id
+            ORDER BY {order} DESC
+            LIMIT ?
+        """, (_window_start(days), date.today().isoformat(), limit))
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    return [{"file_id": fid, "path": path, "opens": opens, "total_duration": total}
+            for fid, path, opens, total in rows]
+
+
+def weekly_usage(file_id, weeks=8):
+    """Hours a file was open per week (Monday start), oldest week first"""
+    today = date.today()
+    this_monday = today - timedelta(days=today.weekday())
+    first_monday = this_monday - timedelta(weeks=weeks - 1)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT day, total_duration FROM daily_file_stats
+            WHERE file_id = ? AND day >= ? AND day <= ?
+        """, (file_id, first_monday.isoformat(), today.isoformat()))
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    hours = [0.0] * weeks
+    for day, total in rows:
+        week = (date.fromisoformat(day) - first_monday).days // 7
+        # Rows dated after a clock change can still fall outside the window
+        if 0 <= week < weeks:
+            hours[week] += total / 3600
+    return [((first_monday + timedelta(weeks=i)).isoformat(), h) for i, h in enumerate(hours)]
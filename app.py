@@ -4,18 +4,15 @@ import os
 import threading
 import time
 import sqlite3
+from datetime import datetime, timedelta
 
-from database import init_db
+from database import init_db, delete_orphan_contents, migrate_content_ids
 from logger import start_file_session, end_file_session
+from analytics import compact_sessions, delete_file_stats, top_files
 from ml.filename_cluster import run_filename_clustering
 
 DB_PATH = os.path.join("data", "file_logs.db")
 
-ctk.set_appearance_mode("dark")
-ctk.set_default_color_theme("blue")
-
-init_db()
-
 # Enhanced color scheme
 COLORS = {
     "Study": "#4A90E2",        # Professional blue
@@ -32,6 +29,25 @@ HEADER_FONT = ("Arial", 16, "bold")
 BUTTON_FONT = ("Arial", 12, "bold")
 BODY_FONT = ("Arial", 11)
 
+# Search filter choices
+ANY_OPTION = "Any"
+LABEL_OPTIONS = [ANY_OPTION, "Study", "Work", "Personal"]
+EXTENSION_OPTIONS = [ANY_OPTION, "pdf", "txt", "doc", "docx", "ppt", "pptx", "xls", "xlsx", "csv"]
+# Calendar days including today, counted the same way as the Analytics tab
+OPENED_OPTIONS = {
+    "Any time": None,
+    "Today": 1,
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+}
+
+# Analytics windows (days)
+ANALYTICS_WINDOWS = {
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+    "Last 90 days": 90,
+}
+
 
 class App(ctk.CTk):
     def __init__(self):
@@ -48,18 +64,32 @@ class App(ctk.CTk):
         self.priority_tab = self.tabs.add("Priority View")
         self.cluster_tab = self.tabs.add("Grouped View")
         self.search_tab = self.tabs.add("Semantic Search")
+        self.analytics_tab = self.tabs.add("Analytics")
 
         # Build each tab UI
         self.build_priority_tab()
         self.build_cluster_tab()
         self.build_search_tab()
+        self.build_analytics_tab()
 
         # Initialize semantic searcher lazily (will be loaded on first use)
         self.semantic_searcher = None
+        self.searcher_lock = threading.Lock()
+        # Set when labels or open times change so search filters get rebuilt
+        self.search_metadata_stale = False
+        # Set when file content is added, changed or removed so the next
+        # search embeds new passages and drops stale ones
+        self.search_index_stale = False
         
         # Run initial clustering if needed
         self._ensure_clustering()
 
+        # Drop old raw sessions in the background; rollups keep their totals
+        threading.Thread(target=compact_sessions, daemon=True).start()
+
+        # Hash files from older databases without blocking the window
+        threading.Thread(target=self._migrate_contents, daemon=True).start()
+
     def _ensure_clustering(self):
         """Run clustering on startup if no files are clustered yet"""
         try:
@@ -70,18 +100,32 @@ class App(ctk.CTk):
             conn.close()
             
             if clustered_count == 0:
-                # Run clustering in background on startup
-                threading.Thread(target=lambda: run_filename_clustering(), daemon=True).start()
+                # Run clustering in background on startup; this also marks
+                # search metadata stale and refreshes the grouped view
+                threading.Thread(target=self._do_clustering, daemon=True).start()
         except:
             pass
 
+    def _migrate_contents(self):
+        try:
+            if migrate_content_ids():
+                # Migrated documents need embedding on the next search
+                self.search_index_stale = True
+        except Exception as e:
+            print(f"Content migration error: {e}")
+
     def _ensure_semantic_searcher(self):
         """Lazily load SemanticSearch on first use"""
-        if self.semantic_searcher is None:
-            from ml.semantic_search import SemanticSearch
-            self.semantic_searcher = SemanticSearch()
-            self.semantic_searcher.load_files()
-        return self.semantic_searcher
+        # Searches run on worker threads; only one may build the index
+        with self.searcher_lock:
+            if self.semantic_searcher is None:
+                from ml.semantic_search import SemanticSearch
+                self.search_index_stale = False
+                self.search_metadata_stale = False
+                searcher = SemanticSearch()
+                searcher.load_files()
+                self.semantic_searcher = searcher
+            return self.semantic_searcher
 
     # ---------------- Priority View ----------------
 
@@ -192,6 +236,7 @@ class App(ctk.CTk):
         except Exception as e:
             print(f"Clustering error: {e}")
         finally:
+            self.search_metadata_stale = True
             # Update GUI on main thread
             self.after(0, self.load_cluster_files)
 
@@ -276,6 +321,22 @@ class App(ctk.CTk):
             height=40, font=BUTTON_FONT, fg_color=BUTTON_COLOR)
         self.search_btn.pack(fill="x", padx=10, pady=(5, 10))
 
+        # Filters are applied before ranking, so they never drop matches
+        filter_frame = ctk.CTkFrame(self.search_frame, fg_color=FRAME_COLOR, corner_radius=8)
+        filter_frame.pack(fill="x", pady=(0, 10))
+
+        self.label_filter = ctk.CTkOptionMenu(filter_frame, values=LABEL_OPTIONS, width=110)
+        self.label_filter.pack(side="left", padx=(10, 5), pady=10)
+
+        self.ext_filter = ctk.CTkOptionMenu(filter_frame, values=EXTENSION_OPTIONS, width=90)
+        self.ext_filter.pack(side="left", padx=5, pady=10)
+
+        self.opened_filter = ctk.CTkOptionMenu(filter_frame, values=list(OPENED_OPTIONS), width=130)
+        self.opened_filter.pack(side="left", padx=5, pady=10)
+
+        self.folder_filter = ctk.CTkEntry(filter_frame, placeholder_text="Folder (optional)")
+        self.folder_filter.pack(side="left", fill="x", expand=True, padx=(5, 10), pady=10)
+
         self.search_results_frame = ctk.CTkScrollableFrame(self.search_frame)
         self.search_results_frame.pack(
             fill="both", expand=True, padx=10, pady=10)
@@ -297,30 +358,45 @@ class App(ctk.CTk):
         loading_lbl.pack(pady=10)
 
         # Run search in background thread to keep UI responsive
-        threading.Thread(target=self._do_search, args=(query,), daemon=True).start()
-
-    def _do_search(self, query):
+        threading.Thread(target=self._do_search, args=(query, self._search_filters()),
+                         daemon=True).start()
+
+    def _search_filters(self):
+        """Collect filter widget values as SemanticSearch.search keyword arguments"""
+        filters = {}
+        if self.label_filter.get() != ANY_OPTION:
+            filters["cluster_label"] = self.label_filter.get()
+        if self.ext_filter.get() != ANY_OPTION:
+            filters["extension"] = self.ext_filter.get()
+        days = OPENED_OPTIONS.get(self.opened_filter.get())
+        if days is not None:
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            filters["opened_after"] = today - timedelta(days=days - 1)
+        folder = self.folder_filter.get().strip()
+        if folder:
+            filters["path_prefix"] = folder
+        return filters
+
+    def _do_search(self, query, filters):
         try:
             searcher = self._ensure_semantic_searcher()
-            results = searcher.search(query, top_k=20)
+            if self.search_index_stale:
+                # load_files also refreshes metadata
+                self.search_index_stale = False
+                self.search_metadata_stale = False
+                searcher.load_files()
+            elif self.search_metadata_stale:
+                self.search_metadata_stale = False
+                searcher.refresh_metadata()
 
             # Special case: if query is exactly a file extension (pdf, txt, etc),
-            # prioritize files with that extension
-            query_lower = query.lower()
-            if query_lower in ['pdf', 'txt', 'doc', 'docx', 'ppt', 'pptx', 'xls', 'xlsx', 'csv']:
-                # First get all results with lower threshold
-                all_results = searcher.search(query, top_k=20)
-                results = [r for r in all_results if r["score"] >= -0.05]
-                
-                # Boost scores for files matching the extension
-                for r in results:
-                    file_ext = os.path.splitext(r["path"])[1].lower().lstrip('.')
-                    if file_ext == query_lower:
-                        r["score"] += 1.0  # Boost matching extension to top
-                
-                # Re-sort by boosted scores
-                results = sorted(results, key=lambda r: r["score"], reverse=True)
-            else:
+            # list files with that extension without a score threshold
+            extension_query = query.lower() in EXTENSION_OPTIONS[1:]
+            if extension_query:
+                filters = dict(filters, extension=query.lower())
+            results = searcher.search(query, top_k=20, **filters)
+
+            if not extension_query:
                 # Normal search: filter by threshold
                 threshold = 0.1
                 results = [r for r in results if r["score"] >= threshold]
@@ -374,6 +450,14 @@ class App(ctk.CTk):
                                     anchor="w", command=lambda p=path: self.open_from_list(p),
                                     font=BODY_FONT, height=38)
                 btn.pack(fill="x")
+
+                # Identical copies are collapsed into one result; list them all
+                other_paths = [p for p in result.get("paths", [path]) if p != path]
+                if other_paths:
+                    copies_lbl = ctk.CTkLabel(
+                        info_frame, text="   Also at: " + ", ".join(other_paths),
+                        anchor="w", justify="left", text_color="#B0B0B0", font=("Arial", 10))
+                    copies_lbl.pack(fill="x")
                 
                 # Delete button
                 del_btn = ctk.CTkButton(file_frame, text="🗑️", width=38, height=38,
@@ -395,6 +479,73 @@ class App(ctk.CTk):
             self.search_results_frame, text=f"Error: {error_msg}")
         error_lbl.pack(pady=10)
 
+    # ---------------- Analytics Tab ----------------
+
+    def build_analytics_tab(self):
+        # Header frame
+        header_frame = ctk.CTkFrame(self.analytics_tab, fg_color=FRAME_COLOR)
+        header_frame.pack(fill="x", padx=10, pady=(10, 5))
+
+        title_lbl = ctk.CTkLabel(header_frame, text="📊 Analytics", font=HEADER_FONT)
+        title_lbl.pack(side="left", padx=10, pady=10)
+
+        self.analytics_metric = ctk.CTkSegmentedButton(
+            header_frame, values=["Time", "Opens"],
+            command=lambda _: self.load_analytics())
+        self.analytics_metric.set("Time")
+        self.analytics_metric.pack(side="right", padx=10, pady=10)
+
+        self.analytics_window = ctk.CTkOptionMenu(
+            header_frame, values=list(ANALYTICS_WINDOWS),
+            command=lambda _: self.load_analytics())
+        self.analytics_window.set("Last 30 days")
+        self.analytics_window.pack(side="right", padx=5, pady=10)
+
+        # Divider
+        divider = ctk.CTkFrame(self.analytics_tab, fg_color="#3C3C3C", height=1)
+        divider.pack(fill="x", pady=5)
+
+        self.analytics_frame = ctk.CTkScrollableFrame(self.analytics_tab)
+        self.analytics_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
+        self.load_analytics()
+
+    def load_analytics(self):
+        # Clear frame properly by destroying all children
+        try:
+            for w in self.analytics_frame.winfo_children():
+                w.destroy()
+        except:
+            pass
+
+        days = ANALYTICS_WINDOWS[self.analytics_window.get()]
+        metric = "opens" if self.analytics_metric.get() == "Opens" else "duration"
+        try:
+            rows = top_files(days=days, limit=20, metric=metric)
+        except Exception as e:
+            print(f"Error loading analytics: {e}")
+            rows = []
+
+        if not rows:
+            no_data_lbl = ctk.CTkLabel(self.analytics_frame, text="No file activity in this period",
+                                       text_color="#888888")
+            no_data_lbl.pack(pady=20)
+            return
+
+        for row in rows:
+            file_frame = ctk.CTkFrame(self.analytics_frame, fg_color=FRAME_COLOR, corner_radius=8)
+            file_frame.pack(fill="x", pady=3, padx=5)
+
+            btn = ctk.CTkButton(file_frame, text=f"📄 {os.path.basename(row['path'])}", anchor="w",
+                                command=lambda p=row["path"]: self.open_from_list(p),
+                                font=BODY_FONT, height=40)
+            btn.pack(side="left", fill="x", expand=True, padx=2)
+
+            stats_lbl = ctk.CTkLabel(
+                file_frame, text=f"{row['opens']} opens · {row['total_duration'] / 3600:.1f} h",
+                text_color="#B0B0B0", font=BODY_FONT, width=160)
+            stats_lbl.pack(side="right", padx=10)
+
     # ---------------- File open logic ----------------
 
     def open_file(self):
@@ -404,14 +555,16 @@ class App(ctk.CTk):
 
         self.status.configure(text=f"Opened: {file_path}")
 
-        start_file_session(file_path)
+        if start_file_session(file_path):
+            self.search_index_stale = True
         os.startfile(file_path)
 
         threading.Thread(target=self.wait_and_close,
                          args=(file_path,), daemon=True).start()
 
     def open_from_list(self, file_path):
-        start_file_session(file_path)
+        if start_file_session(file_path):
+            self.search_index_stale = True
         os.startfile(file_path)
 
         threading.Thread(target=self.wait_and_close,
@@ -421,6 +574,8 @@ class App(ctk.CTk):
         # simple fixed sleep, replace with better logic if you want
         time.sleep(10)
         end_file_session(file_path)
+        self.search_metadata_stale = True
+        self.after(0, self.load_analytics)
 
     def delete_file(self, file_path):
         """Delete a file and remove it from database"""
@@ -443,7 +598,9 @@ class App(ctk.CTk):
             # Remove from database
             conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
+            delete_file_stats(cur, file_path)
             cur.execute("DELETE FROM files WHERE path = ?", (file_path,))
+            delete_orphan_contents(cur)
             conn.commit()
             conn.close()
             
@@ -462,10 +619,16 @@ class App(ctk.CTk):
         # Refresh all views after closing file
         self.load_priority_files()
         self.load_cluster_files()
-        if self.semantic_searcher is not None:
-            self.semantic_searcher.load_files()  # reload semantic index
+        # The next search reloads the semantic index on its worker thread
+        self.search_index_stale = True
 
 
 if __name__ == "__main__":
+    # Kept out of module scope: embedding workers are spawned and re-import
+    # this module, and must not touch the database or the UI toolkit
+    ctk.set_appearance_mode("dark")
+    ctk.set_default_color_theme("blue")
+    init_db()
+
     app = App()
     app.mainloop()
@@ -1,8 +1,17 @@
+import hashlib
 import sqlite3
 import os
 
+from text_extractor import hash_file
+
 DB_PATH = os.path.join("data", "file_logs.db")
-print("USING DATABASE:", os.path.abspath(DB_PATH))
+# Embedding caches keyed by file id, from before content deduplication
+FILE_ID_CACHES = [
+    os.path.join("data", "file_embeddings.npy"),
+    os.path.join("data", "file_ids.npy"),
+]
+# Files hashed per transaction during the content migration
+MIGRATION_BATCH = 200
 
 
 def get_connection():
@@ -10,6 +19,7 @@ def get_connection():
 
 
 def init_db():
+    print("USING DATABASE:", os.path.abspath(DB_PATH))
     conn = get_connection()
     cur = conn.cursor()
 
@@ -22,6 +32,18 @@ def init_db():
         last_opened TEXT,
         cluster_id INTEGER,
         cluster_label TEXT,
+        searchable_text TEXT,
+        content_id INTEGER,
+        mtime REAL,
+        size INTEGER
+    )
+    """)
+
+    # One row per unique document content, shared by every path holding a copy
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS contents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash TEXT UNIQUE,
         searchable_text TEXT
     )
     """)
@@ -36,5 +58,115 @@ def init_db():
     )
     """)
 
+    # Per-file, per-day session totals kept up to date as sessions close,
+    # so usage queries don't scan the raw sessions table
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_file_stats (
+        file_id INTEGER,
+        day TEXT,
+        opens INTEGER DEFAULT 0,
+        total_duration INTEGER DEFAULT 0,
+        PRIMARY KEY (file_id, day)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_daily_file_stats_day ON daily_file_stats(day)")
+
+    _add_file_columns(cur)
+    _backfill_daily_stats(cur)
+
     conn.commit()
     conn.close()
+
+
+def get_or_create_content(cur, digest, extract_text):
+    """Return the contents row id for `digest`, inserting it if unseen.
+
+    `extract_text` is only called for new content, so copies of an
+    already-indexed document are never extracted again.
+    """
+    cur.execute("SELECT id FROM contents WHERE hash = ?", (digest,))
+    row = cur.fetchone()
+    if row is not None:
+        return row[0]
+    cur.execute("INSERT INTO contents(hash, searchable_text) VALUES (?, ?)",
+                (digest, extract_text()))
+    return cur.lastrowid
+
+
+def delete_orphan_contents(cur):
+    cur.execute("""
+        DELETE FROM contents
+        WHERE id NOT IN (SELECT content_id FROM files WHERE content_id IS NOT NULL)
+    """)
+
+
+def _add_file_columns(cur):
+    """Add columns introduced after the files table was first created"""
+    cur.execute("PRAGMA table_info(files)")
+    columns = {r[1] for r in cur.fetchall()}
+    for name, sql_type in (("content_id", "INTEGER"), ("mtime", "REAL"), ("size", "INTEGER")):
+        if name not in columns:
+            cur.execute(f"ALTER TABLE files ADD COLUMN {name} {sql_type}")
+
+
+def migrate_content_ids():
+    """Move per-file searchable_text from older databases into contents.
+
+    Hashes every legacy file, which can take a long time on a network
+    share, so the app runs this in a background thread. Each batch is
+    hashed first and then written in one short transaction, and the
+    migration resumes where it stopped. Returns the number of files
+    migrated.
+    """
+    # Vectors keyed by file id can't be mapped to content; drop them
+    for path in FILE_ID_CACHES:
+        if os.path.exists(path):
+            print(f"Removing obsolete embedding cache {path}")
+            os.remove(path)
+
+    migrated = 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute("""
+                SELECT id, path, searchable_text FROM files
+                WHERE content_id IS NULL AND searchable_text IS NOT NULL AND searchable_text != ''
+                LIMIT ?
+            """, (MIGRATION_BATCH,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            # Hash with no transaction open; the GUI writes to the same
+            # database and would time out behind a slow read
+            digests = []
+            for fid, path, text in rows:
+                digest = hash_file(path)
+                if digest is None:
+                    # File is gone; fall back to hashing the stored text
+                    digest = "text:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+                digests.append(digest)
+            for (fid, path, text), digest in zip(rows, digests):
+                content_id = get_or_create_content(cur, digest, lambda: text)
+                cur.execute("""
+                    UPDATE files SET content_id = ?, searchable_text = NULL
+                    WHERE id = ? AND content_id IS NULL
+                """, (content_id, fid))
+            conn.commit()
+            migrated += len(rows)
+    finally:
+        conn.close()
+    return migrated
+
+
+def _backfill_daily_stats(cur):
+    """Build rollups from existing sessions the first time the table is used"""
+    cur.execute("SELECT EXISTS (SELECT 1 FROM daily_file_stats)")
+    if cur.fetchone()[0]:
+        return
+    cur.execute("""
+        INSERT INTO daily_file_stats(file_id, day, opens, total_duration)
+        SELECT file_id, substr(open_time, 1, 10), COUNT(*), SUM(duration)
+        FROM sessions
+        GROUP BY file_id, substr(open_time, 1, 10)
+    """)
@@ -1,27 +1,64 @@
+import os
 import time
 from datetime import datetime
-from database import get_connection
-from text_extractor import get_searchable_text
+from analytics import record_session
+from database import get_connection, get_or_create_content, delete_orphan_contents
+from text_extractor import get_searchable_text, hash_file
 
 open_sessions = {}
 
 
+def _file_signature(path):
+    """(mtime, size) of a file, or None if it can't be read"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _content_for(cur, file_path):
+    # Identical copies share one contents row, so text is extracted once
+    digest = hash_file(file_path)
+    if digest is None:
+        return None
+    return get_or_create_content(cur, digest, lambda: get_searchable_text(file_path))
+
+
 def start_file_session(file_path):
+    """Start timing a file and bring its indexed content up to date.
+
+    Returns True when the file now points at content the search index
+    may not have embedded yet (a new file, or one edited since last seen).
+    """
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT id FROM files WHERE path = ?", (file_path,))
+    cur.execute("SELECT id, content_id, mtime, size FROM files WHERE path = ?", (file_path,))
     row = cur.fetchone()
+    signature = _file_signature(file_path)
+    mtime, size = signature or (None, None)
+    content_changed = False
 
     if row is None:
-        searchable_text = get_searchable_text(file_path)
+        content_id = _content_for(cur, file_path)
         cur.execute(
-            "INSERT INTO files(path, access_count, total_time, last_opened, searchable_text) VALUES (?,0,0,?,?)",
-            (file_path, datetime.now().isoformat(), searchable_text)
+            "INSERT INTO files(path, access_count, total_time, last_opened, content_id, mtime, size) VALUES (?,0,0,?,?,?,?)",
+            (file_path, datetime.now().isoformat(), content_id, mtime, size)
         )
         file_id = cur.lastrowid
+        content_changed = content_id is not None
     else:
-        file_id = row[0]
+        file_id, old_content_id, old_mtime, old_size = row
+        # Re-hash only when the file looks different from when it was indexed
+        if signature is not None and signature != (old_mtime, old_size):
+            content_id = _content_for(cur, file_path)
+            cur.execute("UPDATE files SET content_id = ?, mtime = ?, size = ? WHERE id = ?",
+                        (content_id, mtime, size, file_id))
+            if content_id != old_content_id:
+                # The previous version's text goes unless another copy uses it
+                delete_orphan_contents(cur)
+                content_changed = content_id is not None
 
     conn.commit()
     conn.close()
@@ -30,6 +67,7 @@ def start_file_session(file_path):
         "file_id": file_id,
         "start_time": time.time()
     }
+    return content_changed
 
 
 def end_file_session(file_path):
@@ -62,6 +100,8 @@ def end_file_session(file_path):
         WHERE id = ?
     """, (duration, datetime.now().isoformat(), file_id))
 
+    record_session(cur, file_id, start_time, duration)
+
     conn.commit()
     conn.close()
 
@@ -0,0 +1,189 @@
+import os
+import shutil
+import numpy as np
+
+
+CHECKPOINT_DIR = os.path.join("data", "reindex_checkpoint")
+
+# Texts per checkpoint file. An interrupted reindex loses at most one chunk.
+CHECKPOINT_SIZE = 2048
+
+# Peak activation memory per token of a no-grad MiniLM-L6 forward pass.
+# Layers run one at a time, so this is one layer's attention scores and
+# feed-forward intermediate rather than a sum over layers. Measured as
+# peak RSS growth on CPU: ~36 KB/token at 256 tokens, ~30 KB at 128.
+BYTES_PER_TOKEN = 40 * 1024
+# Total across all workers; each worker's batches get an equal share.
+# Model weights (~90 MB per worker) come on top of this.
+MEMORY_BUDGET_MB = 2048
+MAX_BATCH_SIZE = 256
+
+# Below this many texts the cost of spawning worker processes outweighs
+# the gain, so encoding stays in-process.
+MULTIPROCESS_MIN_TEXTS = 512
+# Each worker holds its own model copy, so keep the pool small
+MAX_WORKERS = 4
+
+# Upper bounds (in tokens) of the length buckets
+BUCKET_BOUNDS = (16, 32, 64, 128, 256, 512)
+
+
+def token_lengths(model, texts):
+    """Token count of each text, capped at the model's max sequence length"""
+    max_len = model.max_seq_length
+    encoded = model.tokenizer(list(texts), truncation=True, max_length=max_len,
+                              add_special_tokens=True)
+    return np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.int32)
+
+
+def batch_size_for(seq_len, memory_budget_mb=MEMORY_BUDGET_MB, workers=1):
+    """Largest batch of `seq_len`-token texts that fits in one worker's share of the budget"""
+    budget = memory_budget_mb * 1024 * 1024 // max(1, workers)
+    size = budget // max(1, seq_len * BYTES_PER_TOKEN)
+    return int(max(1, min(MAX_BATCH_SIZE, size)))
+
+
+def length_buckets(lengths):
+    """Group text indices into buckets of similar token length.
+
+    Returns a list of (bucket_max_len, indices) with indices sorted by
+    length, so each batch pads to roughly the same size.
+    """
+    order = np.argsort(lengths, kind="stable")
+    buckets = []
+    start = 0
+    for bound in BUCKET_BOUNDS:
+        end = int(np.searchsorted(lengths[order], bound, side="right"))
+        if end > start:
+            buckets.append((bound, order[start:end]))
+        start = end
+    if start < len(order):
+        buckets.append((int(lengths[order[-1]]), order[start:]))
+    return buckets
+
+
+def start_pool(model, workers=None):
+    """Start a CPU worker pool for encode_multi_process.
+
+    Workers are capped at MAX_WORKERS and each gets an equal share of the
+    cores for its torch threads, so workers × threads ≈ cpu_count.
+    Release it with model.stop_multi_process_pool(pool).
+    """
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, MAX_WORKERS, cpus))
+    threads = str(max(1, cpus // workers))
+    # Spawned workers read these when torch starts up in them
+    saved = {name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS")}
+    os.environ.update({name: threads for name in saved})
+    try:
+        return model.start_multi_process_pool(["cpu"] * workers)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def pool_workers(pool):
+    return 1 if pool is None else len(pool["processes"])
+
+
+def embed_texts(model, texts, pool=None, memory_budget_mb=MEMORY_BUDGET_MB, lengths=None):
+    """Encode texts bucketed by length, returning vectors in input order.
+
+    `lengths` are the texts' token counts if the caller already has them.
+    """
+    dim = model.get_sentence_embedding_dimension()
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    if not texts:
+        return vectors
+
+    if lengths is None:
+        lengths = token_lengths(model, texts)
+    workers = pool_workers(pool)
+    for bound, indices in length_buckets(np.asarray(lengths)):
+        bucket_texts = [texts[i] for i in indices]
+        batch_size = batch_size_for(bound, memory_budget_mb, workers)
+        if pool is not None:
+            encoded = model.encode_multi_process(bucket_texts, pool, batch_size=batch_size)
+        else:
+            encoded = model.encode(bucket_texts, batch_size=batch_size)
+        vectors[indices] = encoded
+    return vectors
+
+
+def _load_checkpoint(checkpoint_dir):
+    done = {}
+    if not os.path.isdir(checkpoint_dir):
+        return done
+    for name in sorted(os.listdir(checkpoint_dir)):
+        if not name.endswith(".npz"):
+            continue
+        with np.load(os.path.join(checkpoint_dir, name)) as chunk:
+            for fid, vec in zip(chunk["ids"].tolist(), chunk["vectors"]):
+                done[fid] = vec
+    return done
+
+
+def _save_chunk(checkpoint_dir, chunk_no, ids, vectors):
+    path = os.path.join(checkpoint_dir, f"chunk_{chunk_no:05d}.npz")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, ids=np.array(ids), vectors=vectors)
+    os.replace(tmp_path, path)
+
+
+def bulk_embed(model, ids, texts, pool=None, checkpoint_dir=CHECKPOINT_DIR,
+               memory_budget_mb=MEMORY_BUDGET_MB):
+    """Embed a large set of texts across a process pool with checkpointing.
+
+    Texts are processed shortest-first in chunks of CHECKPOINT_SIZE; each
+    finished chunk is written to `checkpoint_dir`, and chunks found there
+    from an earlier interrupted run are reused. Returns vectors aligned
+    with `ids`. Call clear_checkpoint() once the result has been saved.
+
+    Pass a `pool` from start_pool() when calling repeatedly; otherwise a
+    pool is started (and stopped) here for large inputs.
+    """
+    done = _load_checkpoint(checkpoint_dir)
+    if done:
+        print(f"Resuming reindex: {len(done)} embeddings found in checkpoint.")
+
+    pending = [i for i, fid in enumerate(ids) if fid not in done]
+    if pending:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        lengths = token_lengths(model, [texts[i] for i in pending])
+        order = np.argsort(lengths, kind="stable")
+        pending = [pending[i] for i in order]
+        lengths = lengths[order]
+
+        own_pool = pool is None and len(pending) >= MULTIPROCESS_MIN_TEXTS
+        if own_pool:
+            pool = start_pool(model)
+        try:
+            chunk_no = len(os.listdir(checkpoint_dir))
+            for start in range(0, len(pending), CHECKPOINT_SIZE):
+                chunk = pending[start:start + CHECKPOINT_SIZE]
+                chunk_ids = [ids[i] for i in chunk]
+                vectors = embed_texts(model, [texts[i] for i in chunk], pool,
+                                      memory_budget_mb,
+                                      lengths[start:start + CHECKPOINT_SIZE])
+                _save_chunk(checkpoint_dir, chunk_no, chunk_ids, vectors)
+                chunk_no += 1
+                done.update(zip(chunk_ids, vectors))
+                print(f"Embedded {min(start + CHECKPOINT_SIZE, len(pending))}/{len(pending)} texts")
+        finally:
+            if own_pool:
+                model.stop_multi_process_pool(pool)
+
+    dim = model.get_sentence_embedding_dimension()
+    vectors = np.empty((len(ids), dim), dtype=np.float32)
+    for i, fid in enumerate(ids):
+        vectors[i] = done[fid]
+    return vectors
+
+
+def clear_checkpoint(checkpoint_dir=CHECKPOINT_DIR):
+    if os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
@@ -1,104 +1,355 @@
-from sklearn.metrics.pairwise import cosine_similarity
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import bisect
+import shutil
 import sqlite3
+import threading
 import os
 
+from ml.bulk_embed import bulk_embed, clear_checkpoint, start_pool, MULTIPROCESS_MIN_TEXTS
+from ml.text_utils import split_passages
+from ml.vector_store import VectorStore, STORE_DIR
 
 DB_PATH = os.path.join("data", "file_logs.db")
-EMBEDDING_CACHE = os.path.join("data", "file_embeddings.npy")
-ID_CACHE = os.path.join("data", "file_ids.npy")
+# Whole-document embeddings from older versions; superseded by passages
+LEGACY_CACHES = [
+    os.path.join("data", "content_embeddings.npy"),
+    os.path.join("data", "content_ids.npy"),
+    os.path.join("data", "vector_store"),
+]
+# On-disk precision of new vector stores: "float32", "float16" or "int8".
+# Stays float32 until `python -m ml.vector_store` has measured the loss
+# of the smaller formats on the real corpus.
+STORE_DTYPE = "float32"
+# Passages embedded per store append (about 75 MB of float32 vectors),
+# bounding memory however long the documents are
+APPEND_BATCH_PASSAGES = 50000
+# Passage key for bulk_embed checkpoints: content_id * MAX_PASSAGES + chunk number
+MAX_PASSAGES = 1 << 20
+# Rewrite the store once this fraction of its rows belongs to deleted content
+COMPACT_FRACTION = 0.25
+# Below this fraction of candidate rows, a filtered search reads only the
+# candidate rows; above it a full sequential scan is cheaper.
+GATHER_FRACTION = 0.5
+
+
+def _normalize_path(path):
+    # normcase folds case on Windows, where paths are case-insensitive
+    return os.path.normcase(path).replace("\\", "/")
+
+
+def top_k_indices(scores, top_k):
+    """Indices of the top_k highest scores, best first"""
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if top_k >= len(scores):
+        return np.argsort(scores)[::-1]
+    top = np.argpartition(scores, -top_k)[-top_k:]
+    return top[np.argsort(scores[top])[::-1]]
 
 
 class SemanticSearch:
     def __init__(self):
         self.model = None
-        self.file_ids = []
-        self.file_paths = []
-        self.vectors = None
+        self.store = None
+        # Guards the store and every index below: search() may run on a
+        # worker thread while load_files()/refresh_metadata() rebuild them
+        self._lock = threading.RLock()
+        # Store rows are passages; the passages of one document are
+        # contiguous and form a group. Content id of each group:
+        self.content_ids = []
+        # Group index of each store row
+        self.row_group = np.zeros(0, dtype=np.int64)
+        # For each group, the indices of its copies in the loc_* arrays
+        self.group_locations = []
+        # Groups whose content still has at least one file
+        self.live = np.zeros(0, dtype=bool)
+
+        # One entry per file ("location"), used to build filter masks
+        self.loc_groups = np.zeros(0, dtype=np.int64)
+        self.loc_file_ids = []
+        self.loc_paths = []
+        self.label_masks = {}
+        self.ext_masks = {}
+        self.path_order = np.zeros(0, dtype=np.int64)
+        self.sorted_paths = []
+        self.opened_order = np.zeros(0, dtype=np.int64)
+        self.sorted_opened = np.zeros(0, dtype="datetime64[us]")
 
     def load_model(self):
-        if self.model is None:
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        with self._lock:
+            if self.model is None:
+                self.model = SentenceTransformer('all-MiniLM-L6-v2')
 
     def load_files(self):
+        with self._lock:
+            self._load_files()
+
+    def _load_files(self):
+        # Ids only; text is read per document while embedding it
         conn = sqlite3.connect(DB_PATH)
         cur = conn.cursor()
         try:
             cur.execute("""
-                SELECT id, path, searchable_text 
-                FROM files 
-                WHERE searchable_text IS NOT NULL AND searchable_text != ''
-                ORDER BY id ASC
+                SELECT c.id
+                FROM contents c
+                WHERE c.searchable_text IS NOT NULL AND c.searchable_text != ''
+                  AND EXISTS (SELECT 1 FROM files f WHERE f.content_id = c.id)
+                ORDER BY c.id ASC
             """)
-            rows = cur.fetchall()
+            live_ids = np.array([r[0] for r in cur.fetchall()], dtype=np.int64)
         finally:
             conn.close()
 
-        self.file_ids = [r[0] for r in rows]
-        self.file_paths = [r[1] for r in rows]
-        texts = [r[2] for r in rows]
-
         self.load_model()
+        self._remove_legacy_caches()
+        self.store = VectorStore(STORE_DIR, STORE_DTYPE)
+
+        # Embed content missing from the store
+        new_entries = live_ids[~np.isin(live_ids, self.store.ids)].tolist()
+        if new_entries:
+            if len(self.store) == 0:
+                print("No embedding cache found. Computing all...")
+            else:
+                print(f"Embedding {len(new_entries)} new documents...")
+            self._embed_passages(new_entries)
+
+        # Content no longer used by any file (deleted, or replaced when a
+        # file was edited) leaves its passages behind; drop them once they
+        # make up a sizeable part of the store
+        keep = np.isin(self.store.ids, live_ids)
+        if len(keep) and (~keep).sum() > COMPACT_FRACTION * len(keep):
+            print(f"Compacting passage store ({int((~keep).sum())} stale rows)...")
+            self.store.compact(keep)
 
-        # No cache → compute all
-        if not os.path.exists(EMBEDDING_CACHE) or not os.path.exists(ID_CACHE):
-            print("No embedding cache found. Computing all...")
-            self.vectors = self.model.encode(texts, show_progress_bar=True)
-            self.save_cache()
+        self._build_groups()
+        self.refresh_metadata()
+
+    def _embed_passages(self, content_ids):
+        """Chunk documents into overlapping passages, embed and append them.
+
+        Each document's text is read from the database when it is chunked,
+        so only the pending passages are held in memory. Passages go to the
+        store in batches of about APPEND_BATCH_PASSAGES, with each
+        document's passages kept in one batch. A single worker pool,
+        started once enough passages are pending, serves every batch.
+        """
+        # Leave room for the [CLS] and [SEP] tokens the model adds
+        max_tokens = self.model.max_seq_length - 2
+        pool = None
+        keys, passages, owners, offsets = [], [], [], []
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.cursor()
+        try:
+            for i, cid in enumerate(content_ids):
+                cur.execute("SELECT searchable_text FROM contents WHERE id = ?", (cid,))
+                row = cur.fetchone()
+                # Content removed since the id list was read
+                text = row[0] if row is not None and row[0] else ""
+                chunks = split_passages(text, self.model.tokenizer, max_tokens)
+                for n, (offset, passage) in enumerate(chunks):
+                    keys.append(cid * MAX_PASSAGES + n)
+                    passages.append(passage)
+                    owners.append(cid)
+                    offsets.append(offset)
+                if len(keys) < APPEND_BATCH_PASSAGES and i + 1 < len(content_ids):
+                    continue
+                if pool is None and len(keys) >= MULTIPROCESS_MIN_TEXTS:
+                    pool = start_pool(self.model)
+                vectors = bulk_embed(self.model, keys, passages, pool)
+                self.store.append(owners, vectors, offsets)
+                clear_checkpoint()
+                keys, passages, owners, offsets = [], [], [], []
+        finally:
+            conn.close()
+            if pool is not None:
+                self.model.stop_multi_process_pool(pool)
+
+    def _build_groups(self):
+        ids = np.asarray(self.store.ids)
+        if len(ids) == 0:
+            self.content_ids = []
+            self.row_group = np.zeros(0, dtype=np.int64)
             return
+        boundary = np.r_[True, ids[1:] != ids[:-1]]
+        self.content_ids = ids[boundary].tolist()
+        self.row_group = np.cumsum(boundary) - 1
 
-        # Load existing cache
-        cached_ids = np.load(ID_CACHE).tolist()
-        cached_vectors = np.load(EMBEDDING_CACHE)
+    def _remove_legacy_caches(self):
+        for path in LEGACY_CACHES:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
 
-        # Detect new files
-        new_entries = []
-        new_texts = []
+    def refresh_metadata(self):
+        """Rebuild the document → file mapping and filter indexes from the database.
 
-        for fid, text in zip(self.file_ids, texts):
-            if fid not in cached_ids:
-                new_entries.append(fid)
-                new_texts.append(text)
+        Cheap compared to load_files (no text or embeddings are read), so
+        it can be called whenever labels or last_opened change.
+        """
+        with self._lock:
+            self._refresh_metadata()
 
-        # Append new embeddings
-        if new_entries:
-            print(f"Embedding {len(new_entries)} new files...")
-            new_vectors = self.model.encode(new_texts, show_progress_bar=True)
+    def _refresh_metadata(self):
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT f.content_id, f.id, f.path, f.cluster_label, f.last_opened
+                FROM files f JOIN contents c ON f.content_id = c.id
+                WHERE c.searchable_text IS NOT NULL AND c.searchable_text != ''
+                ORDER BY f.id ASC
+            """)
+            rows = cur.fetchall()
+        finally:
+            conn.close()
 
-            cached_ids.extend(new_entries)
-            cached_vectors = np.vstack([cached_vectors, new_vectors])
+        by_content = {}
+        for row in rows:
+            by_content.setdefault(row[0], []).append(row[1:])
 
-            np.save(ID_CACHE, np.array(cached_ids))
-            np.save(EMBEDDING_CACHE, cached_vectors)
+        # Store rows stay put when files are deleted; map them to current files
+        self.group_locations = []
+        loc_groups, file_ids, paths, labels, exts, opened = [], [], [], [], [], []
+        for group, cid in enumerate(self.content_ids):
+            indices = []
+            for fid, path, label, last_opened in by_content.get(cid, []):
+                indices.append(len(loc_groups))
+                loc_groups.append(group)
+                file_ids.append(fid)
+                paths.append(path)
+                labels.append(label)
+                exts.append(os.path.splitext(path)[1].lower())
+                opened.append(last_opened or "NaT")
+            self.group_locations.append(indices)
 
-        self.vectors = cached_vectors
+        self.live = np.array([bool(locs) for locs in self.group_locations], dtype=bool)
+        self.loc_groups = np.array(loc_groups, dtype=np.int64)
+        self.loc_file_ids = file_ids
+        self.loc_paths = paths
 
-    def save_cache(self):
-        np.save(ID_CACHE, np.array(self.file_ids))
-        np.save(EMBEDDING_CACHE, self.vectors)
+        # Categorical filters: one boolean mask over locations per value
+        labels = np.array(labels, dtype=object)
+        exts = np.array(exts, dtype=object)
+        self.label_masks = {label: labels == label for label in set(labels.tolist())}
+        self.ext_masks = {ext: exts == ext for ext in set(exts.tolist())}
 
-    def search(self, query, top_k=10):
-        if self.vectors is None or len(self.file_ids) == 0:
-            return []
+        # Range filters: sorted orders, so a range maps to a slice via bisection
+        normalized = [_normalize_path(p) for p in paths]
+        self.path_order = np.argsort(np.array(normalized, dtype=object), kind="stable")
+        self.sorted_paths = [normalized[i] for i in self.path_order]
+        opened = np.array(opened, dtype="datetime64[us]")
+        self.opened_order = np.argsort(opened, kind="stable")
+        self.sorted_opened = opened[self.opened_order]
+
+    def _filter_mask(self, cluster_label=None, extension=None, path_prefix=None,
+                     opened_after=None, opened_before=None):
+        """Boolean mask over locations matching every given filter, or None"""
+        mask = None
+
+        def combine(current, m):
+            return m.copy() if current is None else current & m
+
+        empty = np.zeros(len(self.loc_paths), dtype=bool)
+
+        if cluster_label is not None:
+            mask = combine(mask, self.label_masks.get(cluster_label, empty))
 
+        if extension is not None:
+            ext = extension.lower()
+            if not ext.startswith("."):
+                ext = "." + ext
+            mask = combine(mask, self.ext_masks.get(ext, empty))
+
+        if path_prefix:
+            prefix = _normalize_path(path_prefix)
+            if not prefix.endswith("/"):
+                prefix += "/"
+            lo = bisect.bisect_left(self.sorted_paths, prefix)
+            hi = bisect.bisect_left(self.sorted_paths, prefix + "\U0010ffff")
+            m = empty.copy()
+            m[self.path_order[lo:hi]] = True
+            mask = combine(mask, m)
+
+        if opened_after is not None or opened_before is not None:
+            # NaT (never opened) sorts last and never matches a range
+            lo, hi = 0, int((~np.isnat(self.sorted_opened)).sum())
+            if opened_after is not None:
+                lo = int(np.searchsorted(self.sorted_opened,
+                                         np.datetime64(opened_after, "us"), side="left"))
+            if opened_before is not None:
+                hi = min(hi, int(np.searchsorted(self.sorted_opened,
+                                                 np.datetime64(opened_before, "us"), side="right")))
+            m = empty.copy()
+            m[self.opened_order[lo:hi]] = True
+            mask = combine(mask, m)
+
+        return mask
+
+    def search(self, query, top_k=10, cluster_label=None, extension=None,
+               path_prefix=None, opened_after=None, opened_before=None):
+        """Return the top_k documents most similar to `query`.
+
+        Each document scores as its best-matching passage; the result's
+        "offset" is that passage's position in the document's text.
+        Optional filters restrict candidates before ranking, so filtered
+        queries still return up to top_k matches:
+          cluster_label  -- e.g. "Work"
+          extension      -- e.g. "pdf" or ".pdf"
+          path_prefix    -- folder the file must be under
+          opened_after / opened_before -- datetime or ISO string bounds on last_opened
+        """
         self.load_model()
-        query_vec = self.model.encode([query])
-        
-        # Handle case where vectors might be 1D (empty case)
-        if len(self.vectors.shape) == 1:
+        query_vec = self.model.encode([query])[0]
+
+        with self._lock:
+            return self._search(query_vec, top_k, cluster_label, extension,
+                                path_prefix, opened_after, opened_before)
+
+    def _search(self, query_vec, top_k, cluster_label, extension,
+                path_prefix, opened_after, opened_before):
+        if self.store is None or not self.live.any():
             return []
-        
-        similarities = cosine_similarity(query_vec, self.vectors)[0]
 
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        loc_mask = self._filter_mask(cluster_label, extension, path_prefix,
+                                     opened_after, opened_before)
+        if loc_mask is None:
+            group_mask = self.live
+        else:
+            group_mask = np.zeros(len(self.content_ids), dtype=bool)
+            group_mask[self.loc_groups[loc_mask]] = True
+
+        row_mask = group_mask[self.row_group]
+        candidates = np.flatnonzero(row_mask)
+        if len(candidates) == 0:
+            return []
+
+        if len(candidates) < GATHER_FRACTION * len(row_mask):
+            similarities = self.store.scores(query_vec, rows=candidates)
+        else:
+            similarities = self.store.scores(query_vec)[candidates]
+
+        # Max-pool passage scores per document; candidates are in row
+        # order, so each document's passages form one contiguous run
+        groups = self.row_group[candidates]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        ends = np.r_[starts[1:], len(groups)]
+        best = np.maximum.reduceat(similarities, starts)
 
+        # One result per unique document, listing every matching location
         results = []
-        for idx in top_indices:
+        for i in top_k_indices(best, top_k):
+            start, end = starts[i], ends[i]
+            row = candidates[start + int(np.argmax(similarities[start:end]))]
+            group = groups[start]
+            locs = [l for l in self.group_locations[group] if loc_mask is None or loc_mask[l]]
             results.append({
-                "file_id": self.file_ids[idx],
-                "path": self.file_paths[idx],
-                "score": float(similarities[idx])
+                "file_id": self.loc_file_ids[locs[0]],
+                "path": self.loc_paths[locs[0]],
+                "paths": [self.loc_paths[l] for l in locs],
+                "score": float(best[i]),
+                "offset": int(self.store.offsets[row])
             })
 
         return results
@@ -0,0 +1,49 @@
+# Passage length in model tokens (MiniLM reads 256 including [CLS]/[SEP])
+PASSAGE_TOKENS = 254
+# Tokens shared by consecutive passages
+PASSAGE_OVERLAP = 64
+
+
+def split_passages(text, tokenizer, max_tokens=PASSAGE_TOKENS, overlap=PASSAGE_OVERLAP):
+    """Split text into overlapping windows of at most `max_tokens` tokens.
+
+    Windows are measured with the model's own `tokenizer` (a fast Hugging
+    Face tokenizer), so no passage is silently truncated at embedding
+    time, however many word pieces its words split into. Cuts fall on
+    whitespace where possible so a passage re-tokenizes the same way.
+
+    Returns a list of (char_offset, passage) where char_offset is the
+    position of the passage's first character in `text`.
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                        verbose=False)["offset_mapping"]
+    count = len(offsets)
+    if count == 0:
+        return []
+    # Keep windows advancing by at least three quarters of their length
+    overlap = min(overlap, max_tokens // 4)
+
+    # A token starts a word when whitespace separates it from the previous one
+    word_start = [i == 0 or offsets[i][0] > offsets[i - 1][1] for i in range(count)]
+
+    passages = []
+    start = 0
+    while start < count:
+        end = min(start + max_tokens, count)
+        if end < count:
+            # Back off to a word boundary unless a single word fills the window
+            cut = end
+            while cut > start and not word_start[cut]:
+                cut -= 1
+            if cut > start:
+                end = cut
+        char_start, char_end = offsets[start][0], offsets[end - 1][1]
+        passages.append((char_start, text[char_start:char_end]))
+        if end >= count:
+            break
+
+        nxt = max(end - overlap, start + 1)
+        while nxt < end and not word_start[nxt]:
+            nxt += 1
+        start = nxt
+    return passages
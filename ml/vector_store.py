@@ -0,0 +1,270 @@
+import json
+import os
+import shutil
+import numpy as np
+
+
+# Rows are passages (chunks of a document), not whole documents
+STORE_DIR = os.path.join("data", "passage_store")
+
+# Rows scored per block; bounds the float32 working set during search
+BLOCK_ROWS = 65536
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(vectors, dtype):
+    """Normalize rows and convert to the storage dtype.
+
+    Returns (stored, scales). For int8 each row gets its own scale so
+    that row ≈ stored * scale; other dtypes have no scales.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        stored = np.round(vectors / scales[:, None]).astype(np.int8)
+        return stored, scales
+    return vectors.astype(dtype), None
+
+
+class VectorStore:
+    """Append-only, memory-mapped embedding matrix on disk.
+
+    Rows are L2-normalized before storage, so a dot product with a
+    normalized query is the cosine similarity. Files in `path`:
+    meta.json (dtype, dim, count), ids.bin (int64 owner id per row),
+    offsets.bin (int32 position of the row's passage in the owner's
+    text), vectors.bin and, for int8, scales.bin (float32). Rows past
+    meta["count"] are ignored, which keeps appends safe if the process
+    dies half way.
+    """
+
+    def __init__(self, path=STORE_DIR, dtype="float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.dim = None
+        self.count = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(0, dtype=np.int32)
+        self._vectors = None
+        self._scales = None
+        self.open()
+
+    def __len__(self):
+        return self.count
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def open(self):
+        """(Re)open the memory maps from the files on disk"""
+        self.close()
+        meta_path = self._file("meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # An existing store keeps its dtype regardless of what was requested
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        if self.count == 0:
+            return
+        self.ids = np.memmap(self._file("ids.bin"), dtype=np.int64, mode="r",
+                             shape=(self.count,))
+        self.offsets = np.memmap(self._file("offsets.bin"), dtype=np.int32, mode="r",
+                                 shape=(self.count,))
+        self._vectors = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r",
+                                  shape=(self.count, self.dim))
+        if self.dtype == "int8":
+            self._scales = np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r",
+                                     shape=(self.count,))
+
+    def close(self):
+        # Drop the maps so the files can be appended to (required on Windows)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(0, dtype=np.int32)
+        self._vectors = None
+        self._scales = None
+
+    def _write_meta(self, count):
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"dtype": self.dtype, "dim": self.dim, "count": count}, f)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _append_raw(self, name, array, row_bytes, count):
+        # Cut off rows left over from an interrupted append before writing
+        path = self._file(name)
+        with open(path, "ab") as f:
+            f.truncate(count * row_bytes)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    def append(self, ids, vectors, offsets=None):
+        """Append rows to the store without loading the existing matrix"""
+        if len(ids) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        stored, scales = quantize(vectors, self.dtype)
+        self._append_stored(ids, offsets, stored, scales)
+
+    def _append_stored(self, ids, offsets, stored, scales):
+        if self.dim is None:
+            self.dim = stored.shape[1]
+        if offsets is None:
+            offsets = np.zeros(len(ids), dtype=np.int32)
+        os.makedirs(self.path, exist_ok=True)
+
+        count = self.count
+        self.close()
+        self._append_raw("ids.bin", np.asarray(ids, dtype=np.int64), 8, count)
+        self._append_raw("offsets.bin", np.asarray(offsets, dtype=np.int32), 4, count)
+        self._append_raw("vectors.bin", stored, stored.itemsize * self.dim, count)
+        if scales is not None:
+            self._append_raw("scales.bin", scales, 4, count)
+        self._write_meta(count + len(ids))
+        self.open()
+
+    def compact(self, keep, block_rows=BLOCK_ROWS):
+        """Rewrite the store keeping only rows where `keep` is True.
+
+        Rows are copied in their stored form (no re-quantization) into a
+        sibling directory that then replaces this one.
+        """
+        tmp_path = self.path + ".compact"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        compacted = VectorStore(tmp_path, self.dtype)
+        rows = np.flatnonzero(keep)
+        for start in range(0, len(rows), block_rows):
+            idx = rows[start:start + block_rows]
+            scales = None if self._scales is None else np.asarray(self._scales[idx])
+            compacted._append_stored(np.asarray(self.ids[idx]), np.asarray(self.offsets[idx]),
+                                     np.asarray(self._vectors[idx]), scales)
+        if len(rows) == 0:
+            compacted.dim = self.dim
+            os.makedirs(tmp_path, exist_ok=True)
+            compacted._write_meta(0)
+        compacted.close()
+
+        old_path = self.path + ".old"
+        self.close()
+        os.replace(self.path, old_path)
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.open()
+
+    def rows(self, start, end):
+        """Dequantized float32 copy of rows [start, end)"""
+        block = np.asarray(self._vectors[start:end], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:end, None]
+        return block
+
+    def take(self, indices):
+        """Dequantized float32 copy of the given rows"""
+        block = np.asarray(self._vectors[indices], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[indices, None]
+        return block
+
+    def scores(self, query_vec, rows=None, block_rows=BLOCK_ROWS):
+        """Cosine similarity of `query_vec` against stored rows, computed in blocks.
+
+        With `rows` (sorted row indices) only those rows are read and
+        scored; the result is aligned with `rows`.
+        """
+        total = self.count if rows is None else len(rows)
+        out = np.empty(total, dtype=np.float32)
+        if total == 0:
+            return out
+        query = np.asarray(query_vec, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        for start in range(0, total, block_rows):
+            end = min(start + block_rows, total)
+            if rows is None:
+                block = self.rows(start, end)
+            else:
+                block = self.take(rows[start:end])
+            out[start:end] = block @ query
+        return out
+
+
+def compare_to_float32(vectors, queries, dtype, top_k=10):
+    """Measure the accuracy loss of storing `vectors` as `dtype`.
+
+    Returns the max and mean absolute cosine error against float32 and
+    the mean recall@top_k of the quantized ranking.
+    """
+    exact, _ = quantize(vectors, "float32")
+    stored, scales = quantize(vectors, dtype)
+    approx = stored.astype(np.float32)
+    if scales is not None:
+        approx *= scales[:, None]
+    queries, _ = quantize(queries, "float32")
+
+    exact_scores = queries @ exact.T
+    approx_scores = queries @ approx.T
+    errors = np.abs(exact_scores - approx_scores)
+
+    k = min(top_k, exact.shape[0])
+    recalls = []
+    for e, a in zip(exact_scores, approx_scores):
+        true_top = set(np.argsort(e)[::-1][:k].tolist())
+        got_top = set(np.argsort(a)[::-1][:k].tolist())
+        recalls.append(len(true_top & got_top) / k)
+
+    return {
+        "dtype": dtype,
+        "max_abs_error": float(errors.max()),
+        "mean_abs_error": float(errors.mean()),
+        f"recall@{k}": float(np.mean(recalls)),
+    }
+
+
+def measure_corpus(db_path, sample_size=5000, query_count=200, top_k=10, seed=0):
+    """Quantization accuracy against freshly encoded float32 embeddings.
+
+    Re-encodes a random sample of passages from the documents in
+    `db_path` (so the baseline is never a previously quantized store)
+    and uses the opening words of other passages as queries.
+    """
+    import sqlite3
+    from sentence_transformers import SentenceTransformer
+    from ml.text_utils import split_passages
+
+    conn = sqlite3.connect(db_path)
+    try:
+        texts = [r[0] for r in conn.execute(
+            "SELECT searchable_text FROM contents WHERE searchable_text IS NOT NULL AND searchable_text != ''")]
+    finally:
+        conn.close()
+    model = SentenceTransformer('all-MiniLM-L6-v2')
+    max_tokens = model.max_seq_length - 2
+    passages = [p for text in texts
+                for _, p in split_passages(text, model.tokenizer, max_tokens)]
+    if not passages:
+        return []
+
+    rng = np.random.default_rng(seed)
+    docs = [passages[i] for i in rng.choice(len(passages), size=min(sample_size, len(passages)),
+                                             replace=False)]
+    queries = [" ".join(passages[i].split()[:12])
+               for i in rng.choice(len(passages), size=min(query_count, len(passages)),
+                                   replace=False)]
+
+    doc_vectors = model.encode(docs, convert_to_numpy=True).astype(np.float32)
+    query_vectors = model.encode(queries, convert_to_numpy=True).astype(np.float32)
+    return [compare_to_float32(doc_vectors, query_vectors, dtype, top_k)
+            for dtype in ("float16", "int8")]
+
+
+if __name__ == "__main__":
+    # Report float16/int8 accuracy loss on the local corpus
+    for report in measure_corpus(os.path.join("data", "file_logs.db")):
+        print(report)
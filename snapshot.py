@@ -0,0 +1,256 @@
+"""Export and import the whole index as a single snapshot file.
+
+A snapshot holds a consistent copy of file_logs.db (which includes the
+extracted text in `contents`) and the embedding vector store, so a new
+workstation can be searchable without re-extracting or re-embedding.
+
+Layout: MAGIC, an 8-byte little-endian header length, a JSON header
+(version, members with offset/size/sha256), then the member blobs back
+to back. Import verifies each member and copies it into place.
+
+Usage:
+    python snapshot.py export index.snap
+    python snapshot.py import index.snap [--from-root OLD --to-root NEW]
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import tempfile
+from datetime import datetime
+
+DATA_DIR = "data"
+DB_PATH = os.path.join(DATA_DIR, "file_logs.db")
+# Same directory as ml.vector_store.STORE_DIR; not imported so this tool
+# runs without numpy
+STORE_MEMBER = "passage_store"
+STORE_DIR = os.path.join(DATA_DIR, STORE_MEMBER)
+STORE_FILES = ("meta.json", "ids.bin", "offsets.bin", "vectors.bin", "scales.bin")
+# The only member names an archive may contain
+MEMBER_NAMES = {"file_logs.db"} | {f"{STORE_MEMBER}/{name}" for name in STORE_FILES}
+
+MAGIC = b"CAFOSNAP"
+SNAPSHOT_VERSION = 3
+COPY_CHUNK = 1 << 20
+
+
+def _copy_exact(path, size, write):
+    """Pass exactly `size` bytes of `path` to `write`, failing if it is shorter"""
+    with open(path, "rb") as f:
+        remaining = size
+        while remaining:
+            block = f.read(min(COPY_CHUNK, remaining))
+            if not block:
+                raise ValueError(f"{path} is {size - remaining} bytes, expected {size}")
+            write(block)
+            remaining -= len(block)
+
+
+def _sha256_file(path, size):
+    digest = hashlib.sha256()
+    _copy_exact(path, size, digest.update)
+    return digest.hexdigest()
+
+
+def _store_members():
+    """(name, path, size) of the vector store files, cut at meta's row count"""
+    meta_path = os.path.join(STORE_DIR, "meta.json")
+    if not os.path.exists(meta_path):
+        return [], None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    count, dim = meta["count"], meta["dim"]
+    itemsize = {"float32": 4, "float16": 2, "int8": 1}[meta["dtype"]]
+    sizes = {"ids.bin": count * 8, "offsets.bin": count * 4,
+             "vectors.bin": count * dim * itemsize}
+    if meta["dtype"] == "int8":
+        sizes["scales.bin"] = count * 4
+    members = [(f"{STORE_MEMBER}/{name}", os.path.join(STORE_DIR, name), size)
+               for name, size in sizes.items()]
+    return members, meta
+
+
+def export_snapshot(out_path):
+    """Write a snapshot of the current index to `out_path`"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # Consistent copy of the database even while the app is writing to it
+        db_copy = os.path.join(tmp, "file_logs.db")
+        src = sqlite3.connect(DB_PATH)
+        dst = sqlite3.connect(db_copy)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+
+        # The vector store is append-only, so reading meta first and copying
+        # only that many rows gives a consistent view
+        members = [("file_logs.db", db_copy, os.path.getsize(db_copy))]
+        store_members, meta = _store_members()
+        members += store_members
+        if meta is not None:
+            meta_copy = os.path.join(tmp, "meta.json")
+            with open(meta_copy, "w") as f:
+                json.dump(meta, f)
+            members.append((f"{STORE_MEMBER}/meta.json", meta_copy, os.path.getsize(meta_copy)))
+
+        entries = []
+        offset = 0
+        for name, path, size in members:
+            entries.append({"name": name, "offset": offset, "size": size,
+                            "sha256": _sha256_file(path, size)})
+            offset += size
+        header = json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "created": datetime.now().isoformat(),
+            "members": entries,
+        }).encode("utf-8")
+        data_start = len(MAGIC) + 8 + len(header)
+
+        tmp_out = out_path + ".tmp"
+        with open(tmp_out, "wb") as out:
+            out.write(MAGIC)
+            out.write(struct.pack("<Q", len(header)))
+            out.write(header)
+            for name, path, size in members:
+                _copy_exact(path, size, out.write)
+        os.replace(tmp_out, out_path)
+
+    print(f"Snapshot written to {out_path} ({len(entries)} members)")
+
+
+def _read_header(mm):
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a snapshot file")
+    (header_len,) = struct.unpack("<Q", mm[len(MAGIC):len(MAGIC) + 8])
+    header_start = len(MAGIC) + 8
+    header = json.loads(mm[header_start:header_start + header_len].decode("utf-8"))
+    if header["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {header['version']}")
+    return header, header_start + header_len
+
+
+def _split_root(path, root, fold_case):
+    """Remainder of `path` below `root` ("" for root itself), or None.
+
+    Both use "/" separators; only whole path components match, so
+    /mnt/share does not match /mnt/share2.
+    """
+    key, prefix = (path.lower(), root.lower()) if fold_case else (path, root)
+    if key == prefix:
+        return ""
+    if key.startswith(prefix + "/"):
+        return path[len(root):]
+    return None
+
+
+def remap_paths(db_path, from_root, to_root):
+    """Rewrite file paths under `from_root` to live under `to_root`.
+
+    Separators are normalized to "/" (as the app's file dialog stores
+    them), and Windows drive roots such as C:/ match case-insensitively.
+    """
+    from_root = from_root.replace("\\", "/").rstrip("/")
+    to_root = to_root.replace("\\", "/").rstrip("/")
+    fold_case = re.match(r"^[A-Za-z]:", from_root) is not None
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, path FROM files")
+        updates = []
+        for fid, path in cur.fetchall():
+            rest = _split_root(path.replace("\\", "/"), from_root, fold_case)
+            if rest is not None:
+                updates.append((to_root + rest, fid))
+        cur.executemany("UPDATE files SET path = ? WHERE id = ?", updates)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(updates)
+
+
+def _recover_interrupted_swap():
+    """Clean up after an import that stopped partway through its swap.
+
+    With DATA_DIR missing, DATA_DIR.old is the only copy of the index and
+    is moved back. With both present, the swap finished and only the
+    final cleanup was lost, so the old copy is removed.
+    """
+    old = DATA_DIR + ".old"
+    if not os.path.exists(old):
+        return
+    if os.path.exists(DATA_DIR):
+        shutil.rmtree(old)
+    else:
+        print(f"Restoring {DATA_DIR} from an interrupted import")
+        os.replace(old, DATA_DIR)
+
+
+def import_snapshot(snapshot_path, from_root=None, to_root=None):
+    """Replace the local index with the snapshot at `snapshot_path`.
+
+    Members are verified and unpacked into a staging directory next to
+    DATA_DIR, which is then swapped in with renames, so a failed import
+    leaves the current index untouched. Run while the app is closed.
+    """
+    _recover_interrupted_swap()
+    staging = DATA_DIR + ".importing"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+
+    try:
+        with open(snapshot_path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header, data_start = _read_header(mm)
+            with memoryview(mm) as view:
+                for entry in header["members"]:
+                    if entry["name"] not in MEMBER_NAMES:
+                        raise ValueError(f"Unexpected snapshot member: {entry['name']!r}")
+                    start = data_start + entry["offset"]
+                    with view[start:start + entry["size"]] as blob:
+                        if hashlib.sha256(blob).hexdigest() != entry["sha256"]:
+                            raise ValueError(f"Checksum mismatch for {entry['name']}")
+                        target = os.path.join(staging, *entry["name"].split("/"))
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with open(target, "wb") as out:
+                            out.write(blob)
+
+        if from_root is not None and to_root is not None:
+            count = remap_paths(os.path.join(staging, "file_logs.db"), from_root, to_root)
+            print(f"Remapped {count} paths from {from_root} to {to_root}")
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    old = DATA_DIR + ".old"
+    if os.path.exists(DATA_DIR):
+        os.replace(DATA_DIR, old)
+    os.replace(staging, DATA_DIR)
+    shutil.rmtree(old, ignore_errors=True)
+
+    print(f"Imported snapshot created {header['created']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import an index snapshot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export")
+    exp.add_argument("path")
+    imp = sub.add_parser("import")
+    imp.add_argument("path")
+    imp.add_argument("--from-root", help="path prefix used on the exporting machine")
+    imp.add_argument("--to-root", help="path prefix to use on this machine")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.path)
+    else:
+        if (args.from_root is None) != (args.to_root is None):
+            parser.error("--from-root and --to-root must be given together")
+        import_snapshot(args.path, args.from_root, args.to_root)
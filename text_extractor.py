@@ -1,3 +1,4 @@
+import hashlib
 import os
 import pdfplumber
 
@@ -17,6 +18,22 @@ def extract_text_from_pdf(path):
         return ""
 
 
+def hash_file(path):
+    """SHA-256 of a document's bytes, or None for non-documents/unreadable files"""
+    _, ext = os.path.splitext(path)
+    if ext.lower() not in DOCUMENT_EXTENSIONS:
+        return None
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    except OSError as e:
+        print(f"Error hashing {path}: {e}")
+        return None
+    return digest.hexdigest()
+
+
 def clean_filename_text(path):
     name = os.path.basename(path)
     name = os.path.splitext(name)[0]